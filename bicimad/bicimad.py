@@ -1,9 +1,91 @@
 import io
+import os
 import pandas as pd
 import re
 import requests
+import shutil
+import tempfile
 import zipfile
-from typing import TextIO
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from typing import BinaryIO, ClassVar
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    _HAS_PYARROW = True
+    _CSV_ENGINE = 'pyarrow'
+    _STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    _HAS_PYARROW = False
+    _CSV_ENGINE = 'c'
+    _STRING_DTYPE = 'string'
+
+_HREF_RE = re.compile(r'href="([^"]*trips[^"]*\.aspx)"')
+_INNER_CSV_RE = re.compile(r'(trips.*)-')
+_NAME_RE = re.compile(r'trips_(\d{2})_(\d{2})_')
+_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+_READ_BUFFER_SIZE = 1024 * 1024
+_MAX_WORKERS = 8
+_CACHE_DIR = '~/.cache/bicimad'
+# Se incrementa cada vez que cambia el esquema de los datos limpios, para no leer cachés antiguas.
+_CACHE_VERSION = 1
+
+# Sesión compartida para reutilizar las conexiones TCP/TLS con la EMT entre peticiones.
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=_MAX_WORKERS))
+
+KEEP_COLS = ['fecha', 'idBike', 'fleet', 'trip_minutes', 'geolocation_unlock', 'address_unlock', 'unlock_date',
+             'locktype', 'unlocktype', 'geolocation_lock', 'address_lock', 'lock_date', 'station_unlock',
+             'unlock_station_name', 'station_lock', 'lock_station_name']
+
+DTYPES = {
+    'idBike': 'Int32',
+    'fleet': 'Int8',
+    'trip_minutes': 'float64',
+    'geolocation_unlock': _STRING_DTYPE,
+    'address_unlock': 'category',
+    'geolocation_lock': _STRING_DTYPE,
+    'address_lock': 'category',
+    'unlock_station_name': 'category',
+    'lock_station_name': 'category',
+    'station_unlock': 'Int32',
+    'station_lock': 'Int32',
+    'locktype': 'category',
+    'unlocktype': 'category',
+}
+
+DATE_FORMATS = {
+    'fecha': '%Y-%m-%d',
+    'unlock_date': '%Y-%m-%dT%H:%M:%S',
+    'lock_date': '%Y-%m-%dT%H:%M:%S',
+}
+
+DATE_COLS = list(DATE_FORMATS)
+
+
+class _ZipMemberReader(io.BufferedReader):
+    """
+    Lector con buffer de un fichero contenido en un zip, que mantiene abiertos el zip y el fichero en el que está
+    guardado mientras se lee y los cierra al cerrarse.
+    """
+
+    def __init__(self, zfile: zipfile.ZipFile, name: str, fileobj: BinaryIO,
+                 buffer_size: int = _READ_BUFFER_SIZE) -> None:
+        super().__init__(zfile.open(name), buffer_size=buffer_size)
+        self._zfile = zfile
+        # ZipFile.close() no cierra los ficheros que recibe ya abiertos, así que hay que cerrarlo aparte.
+        self._fileobj = fileobj
+
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            self._zfile.close()
+            self._fileobj.close()
 
 
 class UrlEMT:
@@ -14,17 +96,58 @@ class UrlEMT:
         EMT (str): URL base de la EMT.
         GENERAL (str): Ruta a los datos generales.
         _valid_urls (set): Conjunto de URLs válidas para los datos de los viajes.
+        _index (dict): URLs válidas indexadas por la tupla (mes, año).
+        _cached_valid_urls (set | None): Caché de las URLs válidas compartida por todas las instancias.
+        _default (UrlEMT | None): Instancia compartida devuelta por `UrlEMT.default()`.
     """
 
     EMT = 'https://opendata.emtmadrid.es/'
     GENERAL = "/Datos-estaticos/Datos-generales-(1)"
+    _cached_valid_urls: ClassVar[set | None] = None
+    _default: ClassVar['UrlEMT | None'] = None
 
 
     def __init__(self) -> None:
         """
         Inicializa una instancia de la clase UrlEMT y selecciona las URLs válidas de la web para los datos de los viajes.
+
+        La página de la EMT solo se consulta la primera vez; las siguientes instancias reutilizan las URLs guardadas.
+        """
+        if UrlEMT._cached_valid_urls is None:
+            UrlEMT._cached_valid_urls = UrlEMT.select_valid_urls()
+
+        self._valid_urls = UrlEMT._cached_valid_urls
+        self._index = {}
+
+        for url in self._valid_urls:
+            s = _NAME_RE.search(url)
+            if s:
+                self._index[(int(s.group(2)), int(s.group(1)))] = url
+
+
+    @classmethod
+    def default(cls) -> 'UrlEMT':
+        """
+        Devuelve una instancia de UrlEMT compartida por todo el proceso, creándola la primera vez que se solicita.
+
+        :return: Instancia compartida de UrlEMT.
+        """
+        if cls._default is None:
+            cls._default = cls()
+
+        return cls._default
+
+
+    @classmethod
+    def refresh(cls) -> None:
+        """
+        Vacía la caché de URLs válidas y la instancia compartida, de forma que la siguiente instancia vuelva a
+        consultar la página de la EMT.
+
+        :return: None.
         """
-        self._valid_urls = UrlEMT.select_valid_urls()
+        cls._cached_valid_urls = None
+        cls._default = None
 
 
     @staticmethod
@@ -35,7 +158,7 @@ class UrlEMT:
         :returns: Conjunto de urls con los datos de uso de Bicimad.
         :raises ConnectionError: Si la solicitud HTTP no tiene éxito.
         """
-        r = requests.get(f'{UrlEMT.EMT}{UrlEMT.GENERAL}')
+        r = _SESSION.get(f'{UrlEMT.EMT}{UrlEMT.GENERAL}')
 
         if r.status_code != 200:
             raise ConnectionError("No se pudo conectar con la página de la EMT.")
@@ -48,14 +171,7 @@ class UrlEMT:
            :return: Conjunto de urls con los datos de uso de Bicimad
 
            """
-            valid_urls = set()
-
-            urls_re = re.compile(r"(href=\")(?P<link>.*trips.*aspx)")
-
-            for i in urls_re.finditer(html_txt):
-                valid_urls.add(i.group('link'))
-
-            return valid_urls
+            return set(_HREF_RE.findall(html_txt))
 
         return get_links(r.text)
 
@@ -69,43 +185,53 @@ class UrlEMT:
         :return: URL correspodiente al mes y año introducidos, en formato de texto.
         :raises: ValueError: Si los valores de mes y año no se corresponden con un enlace válido.
         """
-        filename_re = re.compile(fr".*trips_{year}_{month:02}.*")
+        url = self._index.get((month, year))
 
-        for i in self._valid_urls:
-            s = filename_re.search(i)
-            if s:
-                return s.group()
+        if url is None:
+            raise ValueError(f" No existe un enlace para el mes {month} del año 20{year}. \n"
+            "Los datos se encuentran disponibles para el periodo comprendido entre junio de 2021 y febrero de 2023.")
 
-        raise ValueError(f" No existe un enlace para el mes {month} del año 20{year}. \n"
-        "Los datos se encuentran disponibles para el periodo comprendido entre junio de 2021 y febrero de 2023.")
+        return url
 
 
-    def get_csv(self, month: int, year: int) -> TextIO:
+    def get_csv(self, month: int, year: int) -> BinaryIO:
         """
         Devuelve un objeto tipo archivo csv con los datos correspondientes al mes y año proporcionados.
 
+        El zip se descarga en streaming y el csv se lee directamente de él por bloques de 1 MiB, sin descomprimirlo ni
+        decodificarlo entero en memoria.
+
         :param month: Mes del que se obtienen los datos.
         :param year: Año del que se obtienen los datos.
-        :return: Objeto tipo archivo (TextIO) que contiene los datos solicitados en formato csv.
+        :return: Objeto tipo archivo binario (BinaryIO) que contiene los datos solicitados en formato csv.
         """
         url = self.get_url(month, year)
 
-        r = requests.get(f'{UrlEMT.EMT}{url}')
+        # El zip se vuelca por bloques a un fichero temporal que se mantiene en memoria si es pequeño y pasa a disco
+        # si supera _SPOOL_MAX_SIZE.
+        content = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+        zfile = None
 
-        if r.status_code != 200:
-            raise ConnectionError("No se pudo conectar con la página de la EMT.")
-
-        content = io.BytesIO(r.content)
-        zfile = zipfile.ZipFile(content)
+        # Ante cualquier error, el fichero temporal y el zip se cierran antes de propagarlo; si todo va bien pasan a
+        # ser responsabilidad del lector devuelto.
+        try:
+            with _SESSION.get(f'{UrlEMT.EMT}{url}', stream=True) as r:
+                if r.status_code != 200:
+                    raise ConnectionError("No se pudo conectar con la página de la EMT.")
 
-        filename_re = re.compile(r"(trips.*)-")
-        filename = filename_re.search(url).group(1) + ".csv"
+                r.raw.decode_content = True
+                shutil.copyfileobj(r.raw, content)
 
-        with zfile.open(filename) as f:
-            contents = f.read().decode('utf-8')
-            csv = io.StringIO(contents)
+            content.seek(0)
+            zfile = zipfile.ZipFile(content)
+            filename = _INNER_CSV_RE.search(url).group(1) + ".csv"
 
-        return csv
+            return _ZipMemberReader(zfile, filename, content)
+        except BaseException:
+            if zfile is not None:
+                zfile.close()
+            content.close()
+            raise
 
 
 class BiciMad:
@@ -119,50 +245,177 @@ class BiciMad:
         """
 
 
-    def __init__(self, month: int, year: int) -> None:
+    def __init__(self, month: int, year: int, csv: BinaryIO | None = None, url_emt: UrlEMT | None = None) -> None:
         """
         Inicializa una instancia de la clase Bicimad.
 
         :param int month: Mes del que se obtienen los datos.
         :param int year: Año del que se obtienen los datos.
+        :param csv: Objeto tipo archivo con los datos ya descargados. Si no se indica, se descargan de la web de la EMT.
+        :param url_emt: Instancia de UrlEMT con la que se descargan los datos. Por defecto, `UrlEMT.default()`.
         """
         self._month = month
         self._year = year
-        self._data = BiciMad.get_data(month, year)
+        self._data = BiciMad.get_data(month, year, csv, url_emt)
+
+
+    @classmethod
+    def load_many(cls, months: Iterable[tuple[int, int]]) -> list['BiciMad']:
+        """
+        Devuelve una instancia de BiciMad por cada par (mes, año) proporcionado, descargando y leyendo los datos de
+        los distintos meses en paralelo.
+
+        Cada mes se carga una sola vez: si un par aparece repetido, todas sus posiciones comparten la misma instancia.
+
+        :param months: Pares (mes, año) de los que se obtienen los datos.
+        :return: Lista de instancias de BiciMad en el mismo orden que los pares proporcionados.
+        :raises ValueError: Si algún par de mes y año no se corresponde con un enlace válido.
+        """
+        months = list(months)
+        unique_months = list(dict.fromkeys(months))
+        url_emt = UrlEMT.default()
+
+        def load(month_year: tuple[int, int]) -> 'BiciMad':
+            month, year = month_year
+            return cls(month, year, url_emt=url_emt)
+
+        with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
+            loaded = dict(zip(unique_months, executor.map(load, unique_months)))
+
+        return [loaded[month_year] for month_year in months]
 
 
     @staticmethod
-    def get_data(month: int, year: int) -> pd.DataFrame:
+    def get_data(month: int, year: int, csv: BinaryIO | None = None, url_emt: UrlEMT | None = None) -> pd.DataFrame:
         """
-        Devuelve un DataFrame con los datos de los viajes de Bicimad para el mes y año proporcionados.
+        Devuelve un DataFrame limpio con los datos de los viajes de Bicimad para el mes y año proporcionados.
+
+        Si pyarrow está instalado se usa su motor de lectura de csv, que es multihilo; si no, el motor de C de pandas.
+        Los datos descargados de la EMT se guardan además en una caché en formato parquet (ver `BiciMad.cache_path`),
+        de la que se leen en las siguientes llamadas.
 
         :param month: Mes del que se obtienen los datos.
         :param year: Año del que se obtienen los datos.
+        :param csv: Objeto tipo archivo con los datos ya descargados. Si no se indica, se descargan de la web de la EMT.
+        :param url_emt: Instancia de UrlEMT con la que se descargan los datos. Por defecto, `UrlEMT.default()`.
         :return: Un DataFrame con los datos de los viajes de Bicimad solicitados.
         """
-        csv = UrlEMT().get_csv(month, year)
+        path = BiciMad.cache_path(month, year) if csv is None and _HAS_PYARROW else None
+
+        if path is not None and path.exists():
+            try:
+                df = pd.read_parquet(path)
+            except Exception:
+                # Si la caché no se puede leer, los datos se vuelven a descargar y se sobrescribe.
+                pass
+            else:
+                # Al leer el parquet las cadenas de texto pierden el almacenamiento de pyarrow.
+                return df.astype({col: _STRING_DTYPE for col in df.select_dtypes('string').columns})
+
+        if csv is None:
+            # El csv descargado se cierra al terminar de leerlo; uno proporcionado por el usuario se deja abierto.
+            with (url_emt or UrlEMT.default()).get_csv(month, year) as csv:
+                df = BiciMad._read_csv(csv)
+        else:
+            df = BiciMad._read_csv(csv)
+
+        BiciMad._clean_data(df)
+
+        if path is not None:
+            BiciMad._write_cache(df, path)
 
-        df = pd.read_csv(csv, delimiter = ';', index_col = ['fecha'] )
+        return df
 
-        columns = ['idBike', 'fleet', 'trip_minutes', 'geolocation_unlock', 'address_unlock', 'unlock_date', 'locktype',
-                   'unlocktype', 'geolocation_lock', 'address_lock', 'lock_date', 'station_unlock',
-                   'unlock_station_name', 'station_lock', 'lock_station_name']
 
-        delete = []
+    @staticmethod
+    def _read_csv(csv: BinaryIO) -> pd.DataFrame:
+        """
+        Lee el csv de los viajes de Bicimad con el esquema de columnas y tipos del módulo.
 
-        for column in list(df.columns):
-            if column not in columns:
-                delete.append(column)
+        :param csv: Objeto tipo archivo con los datos en formato csv.
+        :return: DataFrame con los datos leídos, indexado por la columna 'fecha'.
+        """
+        if _CSV_ENGINE == 'pyarrow':
+            # Se usa pyarrow.csv directamente porque el motor 'pyarrow' de pandas infiere las fechas antes de aplicar
+            # los dtypes y pierde el texto original. Aquí las fechas se leen como texto y se convierten después.
+            convert_options = pa_csv.ConvertOptions(include_columns=KEEP_COLS, strings_can_be_null=True,
+                                                    column_types={col: pa.string() for col in DATE_COLS})
+            table = pa_csv.read_csv(csv, parse_options=pa_csv.ParseOptions(delimiter=';'),
+                                    convert_options=convert_options)
+            types_mapper = {pa.string(): pd.StringDtype('pyarrow'), pa.int64(): pd.Int64Dtype()}.get
+            df = table.to_pandas(types_mapper=types_mapper).astype(DTYPES)
+            BiciMad._parse_dates(df)
+            return df.set_index('fecha')
+
+        # parse_dates deja la columna como texto si algún valor no se ajusta al formato, así que las fechas se leen como
+        # texto y se convierten después, igual que con pyarrow.
+        dtypes = DTYPES | {col: _STRING_DTYPE for col in DATE_COLS}
+        df = pd.read_csv(csv, delimiter = ';', usecols = KEEP_COLS, dtype = dtypes, encoding = 'utf-8', engine = 'c')
+        BiciMad._parse_dates(df)
+        return df.set_index('fecha')
 
-        df.drop(columns=delete, inplace=True)
-        df.index = pd.to_datetime(df.index, errors='coerce')
 
-        return df
+    @staticmethod
+    def _parse_dates(df: pd.DataFrame) -> None:
+        """
+        Convierte a fechas las columnas de DATE_COLS según su formato. Los valores que no se ajustan al formato pasan a
+        ser NaT.
+
+        :param df: DataFrame con las columnas de fechas leídas como texto.
+        :return: None. Modifica el DataFrame proporcionado.
+        """
+        for col_name, date_format in DATE_FORMATS.items():
+            df[col_name] = pd.to_datetime(df[col_name], format=date_format, errors='coerce')
+
+
+    @staticmethod
+    def _write_cache(df: pd.DataFrame, path: Path) -> None:
+        """
+        Guarda el DataFrame en la caché en formato parquet. Si no se puede escribir, los datos simplemente no se
+        guardan.
+
+        :param df: DataFrame con los datos limpios de los viajes.
+        :param path: Ruta del fichero parquet de la caché.
+        :return: None.
+        """
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Se escribe en un fichero temporal propio y se renombra, de forma que nunca quede un parquet a medias en
+            # la caché aunque haya varias escrituras simultáneas del mismo mes.
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.parquet.tmp')
+            os.close(fd)
+        except OSError:
+            return
+
+        try:
+            df.to_parquet(tmp_name, compression='zstd')
+            os.replace(tmp_name, path)
+        except Exception:
+            # Incluye los errores de pyarrow al serializar, que no derivan de OSError.
+            pass
+        finally:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+
+
+    @staticmethod
+    def cache_path(month: int, year: int) -> Path:
+        """
+        Devuelve la ruta del fichero parquet en el que se guardan los datos del mes y año proporcionados.
+
+        El directorio de la caché es el indicado en la variable de entorno BICIMAD_CACHE o, por defecto,
+        `~/.cache/bicimad`.
+
+        :param month: Mes del que se obtienen los datos.
+        :param year: Año del que se obtienen los datos.
+        :return: Ruta del fichero parquet.
+        """
+        cache_dir = Path(os.environ.get('BICIMAD_CACHE', _CACHE_DIR)).expanduser()
+        return cache_dir / f'v{_CACHE_VERSION}_{year:02}_{month:02}.parquet'
 
 
     @property
     def data(self) -> pd.DataFrame:
-        self.clean()
         return self._data
 
 
@@ -172,15 +425,24 @@ class BiciMad:
 
     def clean(self) -> None:
         """
-        Limpia el DataFrame almacenado en `self._data`, eliminando filas con todos sus valores NaN y convirtiendo valores
-        de columnas específicas a cadenas de texto.
+        No hace nada: `get_data` ya devuelve los datos limpios. Se mantiene por compatibilidad.
+
+        :return: None.
+        """
+
+
+    @staticmethod
+    def _clean_data(df: pd.DataFrame) -> None:
+        """
+        Elimina las filas con todos sus valores NaN y convierte a cadenas de texto las columnas de identificadores.
 
-        :return: None. Modifica el DataFrame en el atributo `self._data`.
+        :param df: DataFrame con los datos de los viajes.
+        :return: None. Modifica el DataFrame proporcionado.
         """
-        self._data.dropna(axis=0, how='all', inplace=True)
+        df.dropna(axis=0, how='all', inplace=True)
 
         for col_name in ['fleet', 'idBike', 'station_lock', 'station_unlock']:
-            self._data[col_name] = self._data[col_name].map(lambda x: str(int(x)) if isinstance(x, float) and not pd.isna(x) else x)
+            df[col_name] = df[col_name].astype(_STRING_DTYPE)
 
 
     def resume(self) ->pd.Series:
@@ -198,15 +460,16 @@ class BiciMad:
         :return: Serie de pandas con el resumen de los datos.
         """
         data = self.data
+        station_uses = data.groupby('address_unlock', sort=False, observed=True).size()
 
         sr = pd.Series(
             data = [
                 '20'+str(self._year),
                 self._month,
-                data.size,
+                len(data),
                 data['trip_minutes'].sum() / 60,
-                data['address_unlock'].value_counts().index[0],
-                data['address_unlock'].value_counts().iloc[0]
+                station_uses.idxmax(),
+                station_uses.max()
             ],
             index = ['year', 'month', 'total_uses', 'total_time', 'most_popular_station', 'uses_from_most_popular']
         )
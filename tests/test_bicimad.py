@@ -1,13 +1,39 @@
 from bicimad import UrlEMT, BiciMad
 import requests
 import io
+import tempfile
+import zipfile
 import pandas as pd
 import pytest
 from pathlib import Path
 
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    STRING_DTYPE = 'string'
+
 
 FIXTURE_DIR = Path(__file__).parent.resolve() / 'datos'
 
+CLEAN_DTYPES = {
+    'idBike': STRING_DTYPE,
+    'fleet': STRING_DTYPE,
+    'trip_minutes': 'float64',
+    'geolocation_unlock': STRING_DTYPE,
+    'address_unlock': 'category',
+    'locktype': 'category',
+    'unlocktype': 'category',
+    'geolocation_lock': STRING_DTYPE,
+    'address_lock': 'category',
+    'station_unlock': STRING_DTYPE,
+    'unlock_station_name': 'category',
+    'station_lock': STRING_DTYPE,
+    'lock_station_name': 'category',
+}
+
+CLEAN_DATE_COLS = ['fecha', 'unlock_date', 'lock_date']
+
 FILES = pytest.mark.datafiles(
     FIXTURE_DIR / 'emt_datos.html',
     FIXTURE_DIR / 'trips_23_02_February.csv',
@@ -16,6 +42,17 @@ FILES = pytest.mark.datafiles(
 )
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv('BICIMAD_CACHE', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
+
+@pytest.fixture(autouse=True)
+def refresh_urls():
+    UrlEMT.refresh()
+    yield
+    UrlEMT.refresh()
+
 @pytest.fixture
 def files(datafiles):
     d = dict()
@@ -33,16 +70,15 @@ def bicimad_raw(files):
     with open(files['trips_23_02_February.csv'], encoding='utf-8', errors='replace') as f:
         return io.StringIO(f.read())
 
+@pytest.fixture
+def bicimad_raw_bytes(bicimad_raw):
+    return io.BytesIO(bicimad_raw.getvalue().encode('utf-8'))
+
 @pytest.fixture
 def bicimad_clean(files):
     with open(files['bicimad_clean.csv'], encoding='utf-8', errors='replace') as f:
         csv = (io.StringIO(f.read()))
-        df = pd.read_csv(csv, delimiter=',', index_col=['fecha'])
-        df.index = pd.to_datetime(df.index, errors='coerce')
-
-        for col_name in ['fleet', 'idBike', 'station_lock', 'station_unlock']:
-            df[col_name] = df[col_name].map(lambda x: str(int(x)) if pd.notna(x) else x)
-        return df
+        return pd.read_csv(csv, delimiter=',', index_col=['fecha'], dtype=CLEAN_DTYPES, parse_dates=CLEAN_DATE_COLS)
 
 @pytest.fixture
 def bicimad_zip(files):
@@ -60,7 +96,7 @@ def mock_response(monkeypatch, emt_datos):
     def mock_get(*args, **kwargs):
         return MockResponse(emt_datos)
 
-    monkeypatch.setattr(requests, 'get', mock_get)
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
 
 @pytest.fixture
 def mock_response_error(monkeypatch):
@@ -69,10 +105,16 @@ def mock_response_error(monkeypatch):
             self.status_code = 404
             self.text = "Not Found"
 
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
     def mock_get(*args, **kwargs):
         return MockResponse()
 
-    monkeypatch.setattr(requests, 'get', mock_get)
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
 
 @FILES
 def test_select_valid_urls(mock_response):
@@ -84,6 +126,37 @@ def test_select_valid_urls(mock_response):
     assert "/getattachment/e1ea5e02-4ba9-471a-bb95-8cb327220b05/trips_22_03_March-csv.aspx" in valid_urls
     assert "/getattachment/ab3776ab-ba7f-4da3-bea6-e70c21c7d8be/trips_21_06_June-csv.aspx" in valid_urls
 
+@FILES
+def test_valid_urls_cache(monkeypatch, emt_datos):
+    calls = []
+
+    class MockResponse:
+        def __init__(self, text):
+            self.status_code = 200
+            self.text = text
+
+    def mock_get(*args, **kwargs):
+        calls.append(args)
+        return MockResponse(emt_datos)
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+
+    UrlEMT()
+    UrlEMT()
+    assert len(calls) == 1
+
+    UrlEMT.refresh()
+    UrlEMT()
+    assert len(calls) == 2
+
+@FILES
+def test_default(mock_response):
+    url_emt = UrlEMT.default()
+    assert UrlEMT.default() is url_emt
+
+    UrlEMT.refresh()
+    assert UrlEMT.default() is not url_emt
+
 def test_select_valid_urls_error(mock_response_error):
     with pytest.raises(ConnectionError):
         UrlEMT()
@@ -116,12 +189,18 @@ def mock_response_zip(monkeypatch, bicimad_zip, emt_datos):
         def __init__(self, content, text):
             self.status_code = 200
             self.text = text
-            self.content = content
+            self.raw = io.BytesIO(content)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
 
     def mock_get(*args, **kwargs):
         return MockResponse(bicimad_zip, emt_datos)
 
-    monkeypatch.setattr(requests, 'get', mock_get)
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
 
 @pytest.fixture
 def mock_get_url(monkeypatch):
@@ -133,7 +212,58 @@ def mock_get_url(monkeypatch):
 @FILES
 def test_get_csv(mock_response_zip, bicimad_raw):
     csv = UrlEMT().get_csv(2, 23)
-    assert csv.getvalue()[:100] == bicimad_raw.getvalue()[:100]
+    assert isinstance(csv, io.BufferedReader)
+    assert csv.read(100).decode('utf-8') == bicimad_raw.getvalue()[:100]
+
+@FILES
+def test_get_csv_close(mock_response_zip):
+    csv = UrlEMT().get_csv(2, 23)
+    spooled = csv._fileobj
+    csv.close()
+    assert spooled.closed
+
+class BrokenRaw(io.RawIOBase):
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        raise requests.exceptions.ChunkedEncodingError("Conexión interrumpida.")
+
+@pytest.mark.parametrize(
+"raw, url, error", [('not_zip', '/trips_23_02_February-csv.aspx', zipfile.BadZipFile),
+                    ('broken', '/trips_23_02_February-csv.aspx', requests.exceptions.ChunkedEncodingError),
+                    ('zip', 'fake_url', AttributeError),
+                    ('zip', '/trips_23_03_March-csv.aspx', KeyError)])
+@FILES
+def test_get_csv_failure_closes_file(monkeypatch, mock_response, bicimad_zip, raw, url, error):
+    spooled = []
+    spooled_file = tempfile.SpooledTemporaryFile
+
+    def mock_spooled_file(*args, **kwargs):
+        spooled.append(spooled_file(*args, **kwargs))
+        return spooled[-1]
+
+    raws = {'not_zip': lambda: io.BytesIO(b'not a zip'), 'broken': BrokenRaw, 'zip': lambda: io.BytesIO(bicimad_zip)}
+
+    class MockResponse:
+        def __init__(self):
+            self.status_code = 200
+            self.raw = raws[raw]()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+    url_emt = UrlEMT()
+    monkeypatch.setattr(requests.Session, 'get', lambda *args, **kwargs: MockResponse())
+    monkeypatch.setattr(tempfile, 'SpooledTemporaryFile', mock_spooled_file)
+    monkeypatch.setattr(UrlEMT, 'get_url', lambda *args: url)
+
+    with pytest.raises(error):
+        url_emt.get_csv(2, 23)
+    assert spooled[0].closed
 
 @pytest.mark.parametrize(
 "month , year", [(16, 22), (12, 16), ('patata', 22), (1, 21)])
@@ -146,27 +276,157 @@ def test_get_csv_error(mock_response_error, mock_get_url, month, year):
 
 
 @pytest.fixture
-def mock_csv(monkeypatch, bicimad_raw):
+def mock_csv(monkeypatch, mock_response, bicimad_raw_bytes):
     def mock_get_csv(*args, **kwargs):
-        return bicimad_raw
+        return bicimad_raw_bytes
 
     monkeypatch.setattr(UrlEMT, 'get_csv', mock_get_csv)
 
+@pytest.mark.parametrize("engine", ['c', 'pyarrow'])
 @FILES
-def test_get_data(mock_csv, bicimad_clean):
+def test_get_data(monkeypatch, mock_csv, bicimad_clean, engine):
     # Sirve para testar a la vez los métodos BiciMad.get_data(), self.clean(), y el getter del atributo 'self._data'.
+    if engine == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    monkeypatch.setattr('bicimad.bicimad._CSV_ENGINE', engine)
     a = BiciMad(2, 3)
-    pd.testing.assert_frame_equal(a.data, bicimad_clean)
+    pd.testing.assert_frame_equal(a.data, bicimad_clean, check_categorical=False)
+
+@pytest.mark.parametrize("engine", ['c', 'pyarrow'])
+@FILES
+def test_get_data_bad_dates(monkeypatch, bicimad_raw, engine):
+    if engine == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    monkeypatch.setattr('bicimad.bicimad._CSV_ENGINE', engine)
+    lines = bicimad_raw.getvalue().splitlines()[:9]
+    lines[2] = 'garbage' + lines[2][len('2023-02-01'):]
+    lines[4] = '2023/02/01' + lines[4][len('2023-02-01'):]
+    fields = lines[6].split(';')
+    fields[11] = fields[11].replace('T', ' ')
+    lines[6] = ';'.join(fields)
+    csv = io.BytesIO('\n'.join(lines).encode('utf-8'))
+
+    df = BiciMad(2, 23, csv).data
+    assert df.index.dtype == 'datetime64[ns]'
+    assert df['unlock_date'].dtype == 'datetime64[ns]'
+    assert df['lock_date'].dtype == 'datetime64[ns]'
+    assert df.index.isna().tolist() == [True, True, False, False]
+    assert df['unlock_date'].isna().tolist() == [False, False, False, False]
+    assert df['lock_date'].isna().tolist() == [False, False, True, False]
+
+@FILES
+def test_get_data_cache(monkeypatch, mock_csv, bicimad_clean, cache_dir):
+    pytest.importorskip('pyarrow')
+    BiciMad(2, 23)
+    assert BiciMad.cache_path(2, 23) == cache_dir / 'v1_23_02.parquet'
+    assert BiciMad.cache_path(2, 23).exists()
+    assert not list(cache_dir.glob('*.tmp'))
+
+    def mock_get_csv(*args, **kwargs):
+        raise AssertionError("Los datos deberían leerse de la caché.")
+
+    monkeypatch.setattr(UrlEMT, 'get_csv', mock_get_csv)
+    a = BiciMad(2, 23)
+    pd.testing.assert_frame_equal(a.data, bicimad_clean, check_categorical=False)
+
+@FILES
+def test_get_data_cache_corrupt(mock_csv, bicimad_clean, cache_dir):
+    pytest.importorskip('pyarrow')
+    path = BiciMad.cache_path(2, 23)
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b'not a parquet file')
+
+    a = BiciMad(2, 23)
+    pd.testing.assert_frame_equal(a.data, bicimad_clean, check_categorical=False)
+    assert len(pd.read_parquet(path)) == len(a.data)
+
+@FILES
+def test_get_data_cache_unwritable(monkeypatch, mock_csv, bicimad_clean, tmp_path):
+    # Un fichero normal no puede contener el directorio de la caché, así que no se puede escribir en ella.
+    not_a_dir = tmp_path / 'not_a_dir'
+    not_a_dir.write_text('')
+    monkeypatch.setenv('BICIMAD_CACHE', str(not_a_dir / 'cache'))
+
+    a = BiciMad(2, 23)
+    pd.testing.assert_frame_equal(a.data, bicimad_clean, check_categorical=False)
+    assert not BiciMad.cache_path(2, 23).exists()
+
+@FILES
+def test_get_data_cache_write_error(monkeypatch, mock_csv, bicimad_clean, cache_dir):
+    pytest.importorskip('pyarrow')
+
+    def mock_to_parquet(*args, **kwargs):
+        raise ValueError("Error al serializar.")
+
+    monkeypatch.setattr(pd.DataFrame, 'to_parquet', mock_to_parquet)
+
+    a = BiciMad(2, 23)
+    pd.testing.assert_frame_equal(a.data, bicimad_clean, check_categorical=False)
+    assert not list(cache_dir.iterdir())
+
+@FILES
+def test_get_data_closes_csv(mock_csv, bicimad_raw_bytes, files):
+    BiciMad(2, 23)
+    assert bicimad_raw_bytes.closed
+
+    with open(files['trips_23_02_February.csv'], 'rb') as csv:
+        BiciMad(2, 23, csv)
+        assert not csv.closed
+
+@FILES
+def test_clean_noop(monkeypatch, mock_csv, bicimad_clean):
+    a = BiciMad(2, 23)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("clean() no debería volver a procesar los datos.")
+
+    monkeypatch.setattr(a._data, 'dropna', fail)
+    a.clean()
+    pd.testing.assert_frame_equal(a.data, bicimad_clean, check_categorical=False)
 
 @FILES
 def test_bicimad_str(mock_csv, bicimad_clean):
     a = BiciMad(2,23)
     assert str(a) == str(bicimad_clean)
 
+@pytest.fixture
+def mock_csv_many(monkeypatch, mock_response, files):
+    handles = []
+
+    def mock_get_csv(*args, **kwargs):
+        handles.append(open(files['trips_23_02_February.csv'], 'rb'))
+        return handles[-1]
+
+    monkeypatch.setattr(UrlEMT, 'get_csv', mock_get_csv)
+    yield handles
+    for f in handles:
+        f.close()
+
+@FILES
+def test_load_many(mock_csv_many, bicimad_clean):
+    months = [(2, 23), (1, 23), (12, 22)]
+    result = BiciMad.load_many(months)
+
+    assert [(a._month, a._year) for a in result] == months
+    for a in result:
+        pd.testing.assert_frame_equal(a.data, bicimad_clean, check_categorical=False)
+
+@FILES
+def test_load_many_repeated(mock_csv_many, bicimad_clean):
+    months = [(2, 23), (1, 23), (2, 23), (2, 23), (1, 23)]
+    result = BiciMad.load_many(iter(months))
+
+    assert len(mock_csv_many) == 2
+    assert [(a._month, a._year) for a in result] == months
+    assert result[0] is result[2] is result[3]
+    assert result[1] is result[4]
+    assert result[0] is not result[1]
+    pd.testing.assert_frame_equal(result[0].data, bicimad_clean, check_categorical=False)
+
 @FILES
 def test_resume(mock_csv):
     a = BiciMad(2, 23)
-    resume_8_22 = pd.Series( ['2023', 2, 2527410, 53890.1, "'Plaza de la Cebada nº 16 '", 2189],
+    resume_8_22 = pd.Series( ['2023', 2, 168494, 53890.1, "'Plaza de la Cebada nº 16 '", 2189],
              index =['year', 'month', 'total_uses', 'total_time', 'most_popular_station', 'uses_from_most_popular'])
 
     pd.testing.assert_series_equal(a.resume(), resume_8_22)